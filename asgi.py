@@ -0,0 +1,144 @@
+"""ASGI-сервер бота: те же маршруты, что и у Flask в app.py, но в одном
+цикле событий с telegram Application - без nest_asyncio и отдельных потоков.
+
+Запуск (один процесс - состояние бота не делится между воркерами):
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT
+"""
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+from telegram import Update
+
+import app as bot
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(_):
+    # У каждого воркера свой цикл, свой пул соединений и свой Application
+    await bot.bot_runtime.astart()
+    try:
+        yield
+    finally:
+        await bot.bot_runtime.astop()
+
+
+async def run_blocking(func, *args):
+    """Блокирующие вызовы TiDB - в пул потоков TiDB, цикл не блокируем"""
+    return await bot.db_executor.run(func, *args)
+
+
+async def db_report(report):
+    try:
+        payload, status = await run_blocking(report)
+    except bot.DBExecutorSaturated as e:
+        payload, status = {"status": "busy", "error": str(e)}, 503
+    return JSONResponse(payload, status_code=status)
+
+
+async def home(request):
+    return JSONResponse({
+        "status": "online",
+        "database": bot.storage_label() if bot.db_storage else "not_connected",
+        "free_storage": "5 GB",
+        "bot": "ready" if bot.telegram_app else "not_ready"
+    })
+
+
+async def health(request):
+    return await db_report(bot.health_report)
+
+
+async def db_stats(request):
+    return await db_report(bot.db_stats_report)
+
+
+async def queue_stats(request):
+    return JSONResponse(bot.bot_runtime.stats())
+
+
+async def cache_stats(request):
+    return JSONResponse(bot.stats_cache.stats())
+
+
+async def metrics_endpoint(request):
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+async def profile(request):
+    payload, status = bot.profile_request(
+        request.headers.get('X-Admin-Token'),
+        start=request.method == 'POST',
+        updates=request.query_params.get('updates'),
+        seconds=request.query_params.get('seconds')
+    )
+    return JSONResponse(payload, status_code=status)
+
+
+async def ping(request):
+    return PlainTextResponse("pong")
+
+
+async def set_webhook(request):
+    if not bot.telegram_app:
+        return JSONResponse({"error": "Bot not ready"}, status_code=500)
+
+    try:
+        webhook_url = await bot.install_webhook()
+        return JSONResponse({
+            "success": True,
+            "webhook_url": webhook_url,
+            "message": "Вебхук установлен!"
+        })
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def webhook(request):
+    if request.headers.get('X-Telegram-Bot-Api-Secret-Token') != bot.WEBHOOK_SECRET:
+        return PlainTextResponse('Unauthorized', status_code=403)
+
+    if not bot.telegram_app:
+        return PlainTextResponse('Bot not ready', status_code=503)
+
+    parse_started = time.perf_counter()
+    try:
+        data = await request.json()
+    except ValueError:
+        return PlainTextResponse('Bad Request', status_code=400)
+
+    try:
+        update = Update.de_json(data, bot.telegram_app.bot)
+        bot.profiler.note_parse(update.update_id, time.perf_counter() - parse_started)
+
+        # Очередь полна - Telegram повторит доставку позже
+        if not await bot.bot_runtime.enqueue(update):
+            return PlainTextResponse('Too Many Requests', status_code=503)
+
+        return PlainTextResponse('OK')
+    except Exception as e:
+        bot.rate_limited_log.error(logger, 'webhook', "❌ Webhook error: %s", e)
+        return PlainTextResponse('Internal Server Error', status_code=500)
+
+
+app = Starlette(
+    routes=[
+        Route('/', home),
+        Route('/health', health),
+        Route('/db_stats', db_stats),
+        Route('/queue_stats', queue_stats),
+        Route('/cache_stats', cache_stats),
+        Route('/metrics', metrics_endpoint),
+        Route('/profile', profile, methods=['GET', 'POST']),
+        Route('/ping', ping),
+        Route('/set_webhook', set_webhook, methods=['GET']),
+        Route(bot.WEBHOOK_PATH, webhook, methods=['POST']),
+    ],
+    lifespan=lifespan
+)
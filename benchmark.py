@@ -0,0 +1,280 @@
+"""Нагрузочный прогон бота: запись постов и задержка команд статистики.
+
+Гоняет настоящие обработчики (handle_message, /stats, /top, /mystats)
+на синтетическом чате через поддельные Update/CallbackContext - без
+Telegram. Хранилище - встроенный SQLite (--sqlite) или то, на которое
+указывает DATABASE_URL, например локальный MySQL или TiDB (tiup
+playground), так что сеть не нужна:
+    python benchmark.py --sqlite /tmp/bench.db
+    DATABASE_URL=mysql://root@127.0.0.1:4000/bench python benchmark.py
+
+Для каждого объёма (--posts 10000 100000 1000000) чат очищается,
+заполняется через handle_message и буфер записи (прогон проверяет, что
+в базе ровно столько постов), затем каждая команда выполняется --queries
+раз с холодным и с тёплым кэшем; пустой ответ или ошибка прерывают
+прогон. Отчёт:
+пропускная способность и p50/p95/p99 в мс; --json сохраняет его для
+сравнения между версиями.
+
+Одинаковые --seed и параметры нагрузки дают один и тот же чат.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import app as bot
+
+BENCH_CHAT_ID = -1009999000001
+
+
+class FakeMessage(SimpleNamespace):
+    """update.message: то, что читают обработчики, и reply_text без сети"""
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+
+def make_update(update_id, chat_id, user, text, date, message_id):
+    chat = SimpleNamespace(id=chat_id, type='supergroup')
+    message = FakeMessage(
+        chat=chat,
+        chat_id=chat_id,
+        from_user=user,
+        text=text,
+        date=date,
+        message_id=message_id,
+        replies=[]
+    )
+    return SimpleNamespace(
+        update_id=update_id,
+        message=message,
+        effective_chat=chat,
+        effective_user=user,
+        effective_message=message
+    )
+
+
+def make_context(*args):
+    return SimpleNamespace(args=list(args), user_data={}, bot_data={}, chat_data={})
+
+
+class Workload:
+    """Синтетический чат: пользователи, их персонажи, посты по дням и длины постов"""
+
+    def __init__(self, users=50, characters=3, days=90, length_mean=900, length_sigma=0.8,
+                 seed=1, chat_id=BENCH_CHAT_ID):
+        self.users = users
+        self.characters = characters
+        self.days = days
+        self.length_mean = length_mean
+        self.length_sigma = length_sigma
+        self.seed = seed
+        self.chat_id = chat_id
+
+    def _users(self):
+        return [
+            SimpleNamespace(id=100000 + i, username=f'bench_user_{i}', first_name=f'User {i}')
+            for i in range(self.users)
+        ]
+
+    def _length(self, rng):
+        # Логнормальное распределение со средним length_mean
+        mu = math.log(self.length_mean) - self.length_sigma ** 2 / 2
+        return max(1, min(int(rng.lognormvariate(mu, self.length_sigma)), 4096))
+
+    def updates(self, total, now=None):
+        """total поддельных Update с постами, равномерно по последним days дням"""
+        rng = random.Random(self.seed)
+        users = self._users()
+        # Активность пользователей неравномерна - как в живых чатах
+        weights = [1 / (i + 1) for i in range(self.users)]
+        now = now or datetime.now(timezone.utc)
+        step = timedelta(days=self.days) / max(total, 1)
+        start = now - timedelta(days=self.days)
+
+        for i in range(total):
+            user = rng.choices(users, weights)[0]
+            character = f'персонаж {user.id % 1000}-{rng.randrange(self.characters)}'
+            body = 'ё' * self._length(rng)
+            yield make_update(
+                update_id=i + 1,
+                chat_id=self.chat_id,
+                user=user,
+                text=f'{character}\n{body}',
+                # Последний пост - ровно now, чтобы /stats today не был пустым
+                date=start + step * (i + 1),
+                message_id=i + 1
+            )
+
+    def some_user(self):
+        return self._users()[0]
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarize(name, samples, wall_time):
+    samples = sorted(samples)
+    return {
+        'name': name,
+        'count': len(samples),
+        'ops_per_sec': round(len(samples) / wall_time, 1) if wall_time else 0.0,
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p95_ms': round(percentile(samples, 95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+        'max_ms': round(samples[-1] * 1000, 3) if samples else 0.0
+    }
+
+
+async def bench_ingest(workload, total):
+    """Пишет total постов через handle_message; время - до записи в базу"""
+    samples = []
+    context = make_context()
+    started = time.perf_counter()
+    for update in workload.updates(total):
+        t0 = time.perf_counter()
+        await bot.handle_message(update, context)
+        samples.append(time.perf_counter() - t0)
+    handlers_done = time.perf_counter()
+    # Дописываем буфер - в пропускную способность входит запись в базу
+    await bot.post_buffer.close()
+    finished = time.perf_counter()
+
+    # Без этой проверки потерянная запись выглядела бы как быстрая
+    persisted = await bot.db_executor.run(count_chat_posts, workload.chat_id)
+    if persisted != total:
+        raise RuntimeError(f"В базе {persisted} постов чата из {total} - запись не завершена")
+
+    result = summarize('handle_message', samples, handlers_done - started)
+    result['persisted_per_sec'] = round(total / (finished - started), 1)
+    result['flush_tail_ms'] = round((finished - handlers_done) * 1000, 3)
+    return result
+
+
+def count_chat_posts(chat_id):
+    """Постов чата в базе (по дневным суммам - без просмотра posts)"""
+    rows = bot.get_aggregated_stats_from_db(chat_id, 'all') or []
+    return sum(int(row['posts']) for row in rows)
+
+
+def check_replies(name, update):
+    """Команда должна ответить статистикой, а не пустым ответом или ошибкой"""
+    replies = update.message.replies
+    if not replies or any(reply.startswith(('📭', '❌', '⏳')) for reply in replies):
+        raise RuntimeError(f"{name}: нет ответа со статистикой: {replies!r}")
+
+
+COMMANDS = [
+    ('/stats month', bot.stats_command, ('month',)),
+    ('/stats all', bot.stats_command, ('all',)),
+    ('/stats today', bot.stats_command, ('today',)),
+    ('/top month', bot.top_command, ('month',)),
+    ('/top all', bot.top_command, ('all',)),
+    ('/mystats', bot.mystats_command, ()),
+]
+
+
+async def bench_command(workload, name, handler, args, queries, cold):
+    user = workload.some_user()
+    samples = []
+    started = time.perf_counter()
+    for i in range(queries):
+        if cold:
+            bot.stats_cache.invalidate_chat(workload.chat_id)
+        update = make_update(i, workload.chat_id, user, '/' + name, datetime.now(timezone.utc), i)
+        t0 = time.perf_counter()
+        await handler(update, make_context(*args))
+        samples.append(time.perf_counter() - t0)
+        check_replies(name, update)
+    return summarize(f"{name} ({'cold' if cold else 'warm'})", samples, time.perf_counter() - started)
+
+
+async def run_scale(workload, total, queries):
+    bot.clear_posts_sync(workload.chat_id, 'all')
+    bot.stats_cache.invalidate_chat(workload.chat_id)
+
+    results = [await bench_ingest(workload, total)]
+    for name, handler, args in COMMANDS:
+        results.append(await bench_command(workload, name, handler, args, queries, cold=True))
+        results.append(await bench_command(workload, name, handler, args, queries, cold=False))
+    return results
+
+
+def print_report(total, results, out):
+    print(f"\n=== {total:,} постов ===", file=out)
+    print(f"{'operation':<24}{'count':>9}{'ops/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}", file=out)
+    for r in results:
+        print(
+            f"{r['name']:<24}{r['count']:>9}{r['ops_per_sec']:>12}"
+            f"{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}",
+            file=out
+        )
+        if 'persisted_per_sec' in r:
+            print(f"{'  persisted':<24}{'':>9}{r['persisted_per_sec']:>12}", file=out)
+
+
+async def main_async(args):
+    if args.sqlite:
+        bot.STORAGE_BACKEND = 'sqlite'
+        bot.SQLITE_PATH = args.sqlite
+    if not bot.get_storage():
+        raise SystemExit("❌ Хранилище недоступно: задайте DATABASE_URL или --sqlite")
+
+    workload = Workload(
+        users=args.users,
+        characters=args.characters,
+        days=args.days,
+        length_mean=args.length_mean,
+        length_sigma=args.length_sigma,
+        seed=args.seed,
+        chat_id=args.chat_id
+    )
+    report = {'workload': vars(args), 'scales': {}}
+    for total in args.posts:
+        results = await run_scale(workload, total, args.queries)
+        report['scales'][total] = results
+        print_report(total, results, sys.stdout)
+
+    if not args.keep:
+        bot.clear_posts_sync(workload.chat_id, 'all')
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--posts', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--characters', type=int, default=3, help='персонажей у пользователя')
+    parser.add_argument('--days', type=int, default=90, help='на сколько дней назад растянуть посты')
+    parser.add_argument('--length-mean', type=int, default=900, help='средняя длина поста')
+    parser.add_argument('--length-sigma', type=float, default=0.8, help='разброс длины (логнормальный)')
+    parser.add_argument('--queries', type=int, default=50, help='повторов каждой команды')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--chat-id', type=int, default=BENCH_CHAT_ID)
+    parser.add_argument('--sqlite', metavar='PATH', help='встроенный SQLite вместо DATABASE_URL')
+    parser.add_argument('--keep', action='store_true', help='не удалять данные чата после прогона')
+    parser.add_argument('--json', help='сохранить отчёт в файл')
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    report = asyncio.run(main_async(args))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""Продакшен-запуск бота под gunicorn.
+
+    gunicorn -c gunicorn.conf.py asgi:app
+
+По умолчанию воркеры - uvicorn (ASGI, asgi.py): у каждого свой цикл
+событий, свой Application и свой пул TiDB, всё поднимается в lifespan
+уже после fork. Для WSGI (Flask из app.py) задайте
+GUNICORN_WORKER_CLASS=gthread и запускайте app:app - тогда цикл бота
+стартует в post_worker_init.
+
+Миграции схемы (включая пересчёт post_rollups_daily) применяет мастер в
+on_starting - один раз до fork и без timeout воркера. Либо отдельным шагом
+релиза: python app.py migrate и MIGRATE_ON_START=0.
+
+Воркер по умолчанию один: состояние бота живёт в процессе - user_data
+(ожидающие /restore), кэш статистики и его сброс после записи, очереди
+чатов, LRU update_id, сессии /profile. Воркеры не видят состояния друг
+друга, поэтому WEB_CONCURRENCY > 1 ломает их согласованность. Каждый
+воркер держит до DB_POOL_MAX_SIZE соединений с TiDB.
+
+Перезапуск без простоя: kill -HUP <master> перезапускает воркеров,
+но при preload_app код не перечитывается - для нового кода kill -USR2.
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '10000')}"
+
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'uvicorn_worker.UvicornWorker')
+workers = int(os.getenv('WEB_CONCURRENCY', 1))
+# Потоки нужны только gthread-воркерам (Flask); ASGI-воркер конкурентен сам
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+
+# Модули импортируются один раз в мастере; ничего тяжёлого при импорте
+# не создаётся - пул, потоки и Application поднимаются уже в воркере
+preload_app = True
+
+# Telegram ждёт ответа вебхука ~60 с; апдейты обрабатываются в очереди,
+# поэтому сам запрос короткий
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+
+# max_requests не задан: перезапуск воркера терял бы то же состояние процесса
+
+accesslog = None
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def _is_wsgi_worker():
+    return 'uvicorn' not in worker_class.lower()
+
+
+def on_starting(server):
+    # Мастер: модули уже импортированы (preload_app). Пул для миграций
+    # закрывается до fork; воркеры наследуют MIGRATE_ON_START = False.
+    # Если база недоступна, флаг остаётся - миграции попробуют воркеры
+    import app
+    if app.MIGRATE_ON_START and app.migrate_storage() is not None:
+        app.MIGRATE_ON_START = False
+
+
+def post_worker_init(worker):
+    if _is_wsgi_worker():
+        import app
+        app.bot_runtime.ensure_started()
+
+
+def worker_exit(server, worker):
+    if _is_wsgi_worker():
+        import app
+        app.bot_runtime.stop(drain_timeout=graceful_timeout / 2)
@@ -0,0 +1,120 @@
+"""Логирование бота: уровни по модулям, JSON-вывод и прореживание частых событий.
+
+Настройка через переменные окружения:
+    LOG_LEVEL=INFO                          - уровень по умолчанию
+    LOG_LEVELS=app=WARNING,httpx=WARNING    - уровни отдельных логгеров
+    LOG_FORMAT=json                         - одна JSON-строка на запись (по умолчанию text)
+    LOG_RATE_PER_SEC=1, LOG_RATE_BURST=10   - лимит RateLimitedLog на один вид события
+
+Сообщения пишутся с %-аргументами: logger.debug("📊 Найдено: %s", len(rows)).
+Строка собирается только если запись прошла по уровню, поэтому
+отладочные сообщения в горячих путях почти ничего не стоят.
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# httpx пишет INFO на каждый запрос к Bot API (каждый ответ бота)
+DEFAULT_LEVELS = {'httpx': 'WARNING'}
+
+# Атрибуты LogRecord; всё остальное пришло через extra= и попадает в JSON
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись -> одна строка JSON: время, уровень, логгер, сообщение и поля extra"""
+
+    def format(self, record):
+        payload = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith('_'):
+                payload[key] = value
+        if record.exc_info:
+            payload['exc'] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def parse_levels(value):
+    """'app=WARNING,storage=DEBUG' -> {'app': 'WARNING', 'storage': 'DEBUG'}"""
+    levels = {}
+    for item in (value or '').split(','):
+        name, sep, level = item.strip().partition('=')
+        level = level.strip().upper()
+        if sep and name.strip() and isinstance(logging.getLevelName(level), int):
+            levels[name.strip()] = level
+    return levels
+
+
+def configure(stream=None):
+    """Настраивает корневой логгер по переменным окружения (заменяет basicConfig)"""
+    handler = logging.StreamHandler(stream or sys.stderr)
+    if os.getenv('LOG_FORMAT', 'text').lower() == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+
+    levels = dict(DEFAULT_LEVELS, **parse_levels(os.getenv('LOG_LEVELS', '')))
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+
+
+class RateLimitedLog:
+    """Лимит на частые однотипные записи (ошибки на каждое сообщение и т.п.).
+
+    Для каждого key - ведро на burst записей, пополняется rate записей в
+    секунду. Лишние записи отбрасываются до форматирования; первая
+    запись, прошедшая после паузы, сообщает, сколько было отброшено.
+    """
+
+    def __init__(self, rate=1.0, burst=10):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def _allow(self, key):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, dropped = self._buckets.get(key, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, dropped + 1)
+                self.suppressed += 1
+                return None
+            self._buckets[key] = (tokens - 1, now, 0)
+            return dropped
+
+    def log(self, logger, level, key, msg, *args, **kwargs):
+        if not logger.isEnabledFor(level):
+            return
+        dropped = self._allow(key)
+        if dropped is None:
+            return
+        if dropped:
+            msg += ' (пропущено похожих: %d)'
+            args += (dropped,)
+        logger.log(level, msg, *args, **kwargs)
+
+    def error(self, logger, key, msg, *args, **kwargs):
+        self.log(logger, logging.ERROR, key, msg, *args, **kwargs)
+
+    def warning(self, logger, key, msg, *args, **kwargs):
+        self.log(logger, logging.WARNING, key, msg, *args, **kwargs)
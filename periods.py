@@ -0,0 +1,159 @@
+"""Границы периодов статистики (today/week/month/all) с учётом часового пояса чата.
+
+message_date в posts хранится в UTC (Telegram присылает даты в UTC).
+Период считается целыми днями по местному времени чата и переводится в
+полуоткрытый интервал UTC [start, end), чтобы фильтр был вида
+`message_date >= %s AND message_date < %s` и шёл по индексу.
+Дни в post_rollups_daily - тоже местные дни чата, поэтому границы в
+днях ([start_day, end_day)) совпадают с границами по message_date.
+
+Часовые пояса:
+    BOT_TIMEZONE=Europe/Moscow                      - по умолчанию для всех чатов
+    CHAT_TIMEZONES=-100123:Asia/Yekaterinburg,...   - для отдельных чатов
+После смены часовых поясов пересчитайте суммы: /backfill.
+"""
+import logging
+import os
+from collections import namedtuple
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+logger = logging.getLogger(__name__)
+
+# Длина периода в местных днях, включая сегодняшний
+PERIOD_DAYS = {'today': 1, 'week': 7, 'month': 30}
+
+PeriodRange = namedtuple('PeriodRange', 'start end start_day end_day')
+PeriodRange.__doc__ = """[start, end) - наивные datetime в UTC, [start_day, end_day) - местные дни.
+None - без ограничения с этой стороны."""
+
+ALL_TIME = PeriodRange(None, None, None, None)
+
+
+def _zone(name):
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        logger.warning(f"⚠️ Неизвестный часовой пояс {name!r}, используется UTC")
+        return ZoneInfo('UTC')
+
+
+def parse_chat_timezones(value):
+    """'chat_id:Zone/Name,chat_id:Zone/Name' -> {chat_id: ZoneInfo}"""
+    zones = {}
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        chat_id, sep, name = item.partition(':')
+        try:
+            chat_id = int(chat_id)
+        except ValueError:
+            sep = ''
+        if not sep or not name.strip():
+            logger.warning(f"⚠️ Пропущена запись CHAT_TIMEZONES: {item!r}")
+            continue
+        zones[chat_id] = _zone(name.strip())
+    return zones
+
+
+DEFAULT_TIMEZONE = _zone(os.getenv('BOT_TIMEZONE', 'UTC'))
+CHAT_TIMEZONES = parse_chat_timezones(os.getenv('CHAT_TIMEZONES', ''))
+
+
+def chat_timezone(chat_id):
+    return CHAT_TIMEZONES.get(chat_id, DEFAULT_TIMEZONE)
+
+
+def _to_utc_naive(moment):
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _as_utc(message_date):
+    """message_date из Telegram, из базы или из бэкапа -> aware datetime в UTC"""
+    if isinstance(message_date, str):
+        message_date = datetime.fromisoformat(message_date.replace('Z', '+00:00'))
+    if message_date.tzinfo is None:
+        return message_date.replace(tzinfo=timezone.utc)
+    return message_date.astimezone(timezone.utc)
+
+
+def local_day(chat_id, message_date):
+    """Местный день чата, к которому относится пост (ключ post_rollups_daily)"""
+    return _as_utc(message_date).astimezone(chat_timezone(chat_id)).date()
+
+
+def day_start_utc(chat_id, day):
+    """Местная полночь дня day в UTC (наивный datetime)"""
+    return _to_utc_naive(datetime.combine(day, time.min, tzinfo=chat_timezone(chat_id)))
+
+
+def resolve(period, chat_id=None, now=None):
+    """Границы периода для чата. Неизвестный период ('all' и т.п.) - без границ"""
+    days = PERIOD_DAYS.get(period)
+    if days is None:
+        return ALL_TIME
+
+    now = now or datetime.now(timezone.utc)
+    if now.tzinfo is None:
+        now = now.replace(tzinfo=timezone.utc)
+    today = now.astimezone(chat_timezone(chat_id)).date()
+
+    start_day = today - timedelta(days=days - 1)
+    end_day = today + timedelta(days=1)
+    return PeriodRange(
+        day_start_utc(chat_id, start_day),
+        day_start_utc(chat_id, end_day),
+        start_day,
+        end_day
+    )
+
+
+def range_predicate(rng, column='message_date'):
+    """' AND column >= %s AND column < %s' и параметры для интервала UTC"""
+    sql = ''
+    params = []
+    if rng.start is not None:
+        sql += f" AND {column} >= %s"
+        params.append(rng.start)
+    if rng.end is not None:
+        sql += f" AND {column} < %s"
+        params.append(rng.end)
+    return sql, params
+
+
+def day_predicate(rng, column='day'):
+    """' AND day >= %s AND day < %s' и параметры для интервала местных дней"""
+    sql = ''
+    params = []
+    if rng.start_day is not None:
+        sql += f" AND {column} >= %s"
+        params.append(rng.start_day)
+    if rng.end_day is not None:
+        sql += f" AND {column} < %s"
+        params.append(rng.end_day)
+    return sql, params
+
+
+def local_day_sql(column='message_date', chat_column='chat_id'):
+    """SQL-выражение местного дня чата для UTC-колонки и его параметры.
+
+    CONVERT_TZ с именованными поясами TiDB поддерживает сам; в MySQL
+    для этого нужны загруженные таблицы часовых поясов.
+    """
+    zones = {chat_id: zone for chat_id, zone in CHAT_TIMEZONES.items() if zone != DEFAULT_TIMEZONE}
+    if not zones and DEFAULT_TIMEZONE.key == 'UTC':
+        return f"DATE({column})", []
+
+    if not zones:
+        return f"DATE(CONVERT_TZ({column}, '+00:00', %s))", [DEFAULT_TIMEZONE.key]
+
+    cases = ' '.join(['WHEN %s THEN %s'] * len(zones))
+    params = []
+    for chat_id, zone in zones.items():
+        params += [chat_id, zone.key]
+    params.append(DEFAULT_TIMEZONE.key)
+    return (
+        f"DATE(CONVERT_TZ({column}, '+00:00', CASE {chat_column} {cases} ELSE %s END))",
+        params
+    )
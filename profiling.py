@@ -0,0 +1,256 @@
+"""Профилирование обработки update по запросу, на живом боте.
+
+Сессия включается через HTTP (/profile, см. app.py) на следующие N
+update или T секунд. Пока она идёт:
+  - цикл бота работает под cProfile, отчёт - накопленное время по функциям;
+  - каждый update собирает спаны: parse (разбор JSON вебхука), db
+    (ожидание db_executor), aggregate, render, send - с длительностями.
+
+Без сессии begin() и span() сводятся к одной проверке, поэтому хуки
+остаются в коде постоянно:
+    with profiling.span('render'):
+        text = ...
+
+cProfile видит только поток цикла бота; время в потоках db_executor
+видно по спанам db.
+"""
+import contextvars
+import cProfile
+import pstats
+import threading
+import time
+
+_current_trace = contextvars.ContextVar('profiling_trace', default=None)
+
+
+class Trace:
+    """Спаны одного update: [(имя, секунды), ...]"""
+
+    __slots__ = ('session', 'update_id', 'started', 'total', 'spans')
+
+    def __init__(self, session, update_id):
+        self.session = session
+        self.update_id = update_id
+        self.started = time.perf_counter()
+        self.total = 0.0
+        self.spans = []
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'started')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.spans.append((self.name, time.perf_counter() - self.started))
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def activate(trace):
+    """Делает trace текущим для span() в этом контексте; токен - для deactivate"""
+    return _current_trace.set(trace)
+
+
+def deactivate(token):
+    _current_trace.reset(token)
+
+
+def span(name):
+    """Контекстный менеджер спана текущего update (ничего не делает вне сессии)"""
+    trace = _current_trace.get()
+    if trace is None:
+        return _NO_SPAN
+    return _Span(trace, name)
+
+
+class _Session:
+    def __init__(self, updates, seconds):
+        self.updates = updates
+        self.seconds = seconds
+        self.started_at = time.time()
+        self.deadline = time.monotonic() + seconds if seconds else None
+        self.profile = cProfile.Profile()
+        self.enabled = False
+        self.begun = 0
+        self.in_flight = 0
+        self.traces = []
+        self.finished_at = None
+        self.functions = []
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def exhausted(self):
+        return self.updates is not None and self.begun >= self.updates
+
+
+class Profiler:
+    """Сессии профилирования: одна за раз, отчёт о последней хранится до следующей"""
+
+    def __init__(self, top=40, max_traces=200):
+        self.top = top
+        self.max_traces = max_traces
+        self.active = False
+        self._session = None
+        self._parse_times = {}
+        self._lock = threading.Lock()
+
+    def start(self, updates=None, seconds=None, loop=None):
+        """Начинает сессию на updates update и/или seconds секунд.
+
+        loop - цикл бота: по истечении seconds сессия закроется в нём,
+        даже если update больше не придут.
+        """
+        if not updates and not seconds:
+            raise ValueError("Нужно ограничение: число update или секунды")
+        with self._lock:
+            if self.active:
+                raise RuntimeError("Профилирование уже идёт")
+            session = _Session(updates, seconds)
+            self._session = session
+            self._parse_times = {}
+            self.active = True
+        if seconds and loop is not None and loop.is_running():
+            loop.call_soon_threadsafe(loop.call_later, seconds, self._expire, session)
+        return self.report()
+
+    def note_parse(self, update_id, seconds):
+        """Время разбора update из вебхука (до того, как он попал в очередь)"""
+        if not self.active:
+            return
+        with self._lock:
+            if len(self._parse_times) < 10000:
+                self._parse_times[update_id] = seconds
+
+    def begin(self, update_id):
+        """Вызывается в цикле бота перед обработкой update. None - сессии нет"""
+        if not self.active:
+            return None
+        with self._lock:
+            session = self._session
+            if session is None or session.finished_at is not None or session.exhausted():
+                return None
+            if session.expired():
+                self._finish(session)
+                return None
+            session.begun += 1
+            session.in_flight += 1
+            parse_time = self._parse_times.pop(update_id, None)
+        if not session.enabled:
+            # Профиль включается в потоке цикла бота - его он и меряет
+            session.enabled = True
+            try:
+                session.profile.enable()
+            except ValueError:
+                # Уже работает другой профайлер (например, запуск под cProfile)
+                pass
+
+        trace = Trace(session, update_id)
+        if parse_time is not None:
+            trace.spans.append(('parse', parse_time))
+        return trace
+
+    def end(self, trace):
+        trace.total = time.perf_counter() - trace.started
+        session = trace.session
+        with self._lock:
+            session.in_flight -= 1
+            if len(session.traces) < self.max_traces:
+                session.traces.append(trace)
+            done = session.finished_at is None and session.in_flight == 0 and (
+                session.exhausted() or session.expired()
+            )
+            if done:
+                self._finish(session)
+
+    def _expire(self, session):
+        with self._lock:
+            if session.finished_at is None:
+                self._finish(session)
+
+    def _finish(self, session):
+        """Закрывает сессию (под self._lock, в потоке цикла бота)"""
+        if session.enabled:
+            session.profile.disable()
+        session.finished_at = time.time()
+        session.functions = self._function_stats(session.profile)
+        session.profile = None
+        if self._session is session:
+            self.active = False
+
+    def _function_stats(self, profile):
+        try:
+            stats = pstats.Stats(profile)
+        except TypeError:
+            # Профиль не успел ничего записать
+            return []
+        rows = []
+        for (filename, line, name), (_, calls, tottime, cumtime, _) in stats.stats.items():
+            rows.append({
+                'function': f"{filename}:{line}({name})",
+                'calls': calls,
+                'total_ms': round(tottime * 1000, 3),
+                'cumulative_ms': round(cumtime * 1000, 3)
+            })
+        rows.sort(key=lambda row: row['cumulative_ms'], reverse=True)
+        return rows[:self.top]
+
+    def report(self):
+        """Состояние текущей или последней сессии: спаны по update и время по функциям"""
+        with self._lock:
+            session = self._session
+            if session is None:
+                return {'status': 'idle'}
+            traces = list(session.traces)
+            report = {
+                'status': 'finished' if session.finished_at is not None else 'running',
+                'started_at': session.started_at,
+                'finished_at': session.finished_at,
+                'limit_updates': session.updates,
+                'limit_seconds': session.seconds,
+                'updates': session.begun,
+                'in_flight': session.in_flight,
+                'functions': session.functions
+            }
+
+        summary = {}
+        for trace in traces:
+            for name, seconds in trace.spans:
+                item = summary.setdefault(name, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+                item['count'] += 1
+                item['total_ms'] += seconds * 1000
+                item['max_ms'] = max(item['max_ms'], seconds * 1000)
+        for item in summary.values():
+            item['avg_ms'] = round(item['total_ms'] / item['count'], 3)
+            item['total_ms'] = round(item['total_ms'], 3)
+            item['max_ms'] = round(item['max_ms'], 3)
+
+        report['spans'] = summary
+        report['traces'] = [
+            {
+                'update_id': trace.update_id,
+                'total_ms': round(trace.total * 1000, 3),
+                'spans': [[name, round(seconds * 1000, 3)] for name, seconds in trace.spans]
+            }
+            for trace in traces
+        ]
+        return report
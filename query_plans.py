@@ -0,0 +1,108 @@
+"""Проверка планов запросов статистики: ни один не должен читать таблицу целиком.
+
+Запуск (нужен DATABASE_URL, лучше на базе с реальными данными - на пустых
+таблицах оптимизатор и сам выбирает полный просмотр):
+    python query_plans.py [--chat-id ID] [--user-id ID]
+
+Для каждого запроса печатает EXPLAIN и завершается с кодом 1, если где-то
+есть полный просмотр таблицы (type=ALL в MySQL, TableFullScan в TiDB).
+SQL берётся из тех же функций, что строят запросы TiDBStorage (storage.py),
+запросы идут через хранилище бота (get_storage).
+"""
+import argparse
+import sys
+
+import app as bot
+from storage import (
+    BACKUP_POSTS_SQL, aggregated_stats_query, best_characters_query, clear_posts_where,
+    top_users_query
+)
+
+PERIODS = ('today', 'week', 'month', 'all')
+
+
+def plan_cases(chat_id, user_id):
+    """(название, SQL, параметры) для каждого запроса, который выполняет бот"""
+    cases = []
+
+    for period in PERIODS:
+        where, params, rollup_where, rollup_params = clear_posts_where(chat_id, period)
+        cases.append((f'clear_posts count {period}', f"SELECT COUNT(*) FROM posts {where}", params))
+        cases.append((f'clear_posts delete {period}', f"DELETE FROM posts {where}", params))
+        cases.append((
+            f'clear_posts delete rollups {period}',
+            f"DELETE FROM post_rollups_daily {rollup_where}", rollup_params
+        ))
+
+    cases.append(('write_backup_stream', BACKUP_POSTS_SQL, [chat_id]))
+
+    for period in PERIODS:
+        cases.append((f'aggregated stats {period}', *aggregated_stats_query(chat_id, period)))
+        cases.append((
+            f'aggregated stats user {period}',
+            *aggregated_stats_query(chat_id, period, user_id)
+        ))
+        cases.append((f'top users {period}', *top_users_query(chat_id, period)))
+        cases.append((
+            f'best characters {period}',
+            *best_characters_query(chat_id, period, [user_id])
+        ))
+
+    return cases
+
+
+def full_scans(plan):
+    """Строки плана с полным просмотром таблицы"""
+    scans = []
+    for row in plan:
+        row = {str(key).lower(): value for key, value in row.items()}
+        if str(row.get('type', '')).upper() == 'ALL':
+            scans.append(row.get('table') or '?')
+        elif 'TableFullScan' in str(row.get('id', '')):
+            scans.append(row.get('access object') or row.get('id'))
+    return scans
+
+
+def check_query_plans(chat_id=None, user_id=None, out=sys.stdout):
+    """Проверяет все запросы; возвращает список (название, таблицы) с полным просмотром"""
+    storage = bot.get_storage()
+    if not storage or storage.name != 'tidb':
+        raise RuntimeError("TiDB не подключена")
+
+    if chat_id is None or user_id is None:
+        sample_chat, sample_user = storage.last_post_ids() or (0, 0)
+        chat_id = sample_chat if chat_id is None else chat_id
+        user_id = sample_user if user_id is None else user_id
+
+    failures = []
+    for name, query, params in plan_cases(chat_id, user_id):
+        plan = storage.explain(query, params)
+        scans = full_scans(plan)
+        print(f"{'❌' if scans else '✅'} {name}", file=out)
+        for row in plan:
+            print(f"    {row}", file=out)
+        if scans:
+            failures.append((name, scans))
+
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chat-id', type=int)
+    parser.add_argument('--user-id', type=int)
+    args = parser.parse_args(argv)
+
+    failures = check_query_plans(args.chat_id, args.user_id)
+    if failures:
+        print(f"\n❌ Полный просмотр таблицы в {len(failures)} запросах:")
+        for name, scans in failures:
+            print(f"   {name}: {', '.join(map(str, scans))}")
+        return 1
+
+    print("\n✅ Все запросы идут по индексам")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1299 @@
+"""Хранилище постов: общий интерфейс и его реализации.
+
+Бот работает с хранилищем только через методы Storage. Реализации:
+    TiDBStorage   - TiDB Cloud / MySQL через пул pymysql (TiDBConnectionPool),
+                    схема - миграции MIGRATIONS
+    SQLiteStorage - файл SQLite в режиме WAL: один узел, локальные
+                    тесты и бенчмарки без сети
+
+Выбор - STORAGE_BACKEND=tidb|sqlite, путь к файлу - SQLITE_PATH.
+Кэш статистики хранилище не трогает - его сбрасывает вызывающий.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+
+import pymysql
+from pymysql.constants import SERVER_STATUS
+from pymysql.cursors import DictCursor, SSDictCursor
+
+import periods
+
+logger = logging.getLogger(__name__)
+
+
+def unique_in_batch(posts):
+    """Убирает повторы (chat_id, message_id) внутри пачки, первый остаётся"""
+    seen = set()
+    unique = []
+    for post in posts:
+        key = (post[0], post[7])
+        if post[7] is not None:
+            if key in seen:
+                continue
+            seen.add(key)
+        unique.append(post)
+    return unique
+
+
+def rollup_rows(posts):
+    """Сворачивает пачку постов в строки post_rollups_daily"""
+    rollups = {}
+    for chat_id, user_id, username, character_name, message_date, char_count, points, _ in posts:
+        key = (chat_id, periods.local_day(chat_id, message_date), user_id, character_name)
+        row = rollups.get(key)
+        if row is None:
+            rollups[key] = [username, 1, char_count, points]
+        else:
+            row[0] = username
+            row[1] += 1
+            row[2] += char_count
+            row[3] += points
+    return [key + tuple(values) for key, values in rollups.items()]
+
+
+def merge_latest_username(rows):
+    """Строки GROUP BY user_id, character_name, username (с last_day) ->
+    по строке на (user_id, character_name), username - с самого позднего
+    дня пользователя.
+
+    MAX(username) выбрал бы не последнее имя, а наибольшее по алфавиту:
+    после смены «Иван» на «@ivan» осталось бы «Иван».
+    """
+    latest = {}
+    merged = {}
+    for row in rows:
+        user_id = row['user_id']
+        current = latest.get(user_id)
+        if current is None or row['last_day'] > current[0]:
+            latest[user_id] = (row['last_day'], row['username'])
+
+        key = (user_id, row['character_name'])
+        item = merged.get(key)
+        if item is None:
+            merged[key] = {
+                'user_id': user_id,
+                'character_name': row['character_name'],
+                'posts': row['posts'] or 0,
+                'chars': row['chars'] or 0,
+                'points': row['points'] or 0
+            }
+        else:
+            item['posts'] += row['posts'] or 0
+            item['chars'] += row['chars'] or 0
+            item['points'] += row['points'] or 0
+
+    for item in merged.values():
+        item['username'] = latest[item['user_id']][1]
+    return list(merged.values())
+
+
+def with_usernames(top_rows, character_rows):
+    """Проставляет строкам топа username из строк персонажей (merge_latest_username)"""
+    names = {row['user_id']: row['username'] for row in character_rows}
+    for row in top_rows:
+        row['username'] = names.get(row['user_id'])
+    return top_rows
+
+
+class Storage:
+    """Операции бота с хранилищем.
+
+    posts в save_posts - кортежи (chat_id, user_id, username, character_name,
+    message_date, char_count, points, message_id). period - today/week/month/all,
+    границы считает periods.resolve. Методы блокирующие - вызывать через
+    db_executor.
+    """
+
+    name = 'storage'
+
+    def migrate(self):
+        """Создаёт/обновляет схему, возвращает её версию"""
+        raise NotImplementedError
+
+    def ping(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+    def save_posts(self, posts):
+        """Сохраняет пачку и дневные суммы одной транзакцией. Уже сохранённые
+        (chat_id, message_id) пропускает. Возвращает число новых постов"""
+        raise NotImplementedError
+
+    def aggregate(self, chat_id, period='all', user_id=None):
+        """Суммы по (user_id, character_name) за период: словари с ключами
+        user_id, username, character_name, posts, chars, points"""
+        raise NotImplementedError
+
+    def top_users(self, chat_id, period='all', limit=10):
+        """(топ пользователей по очкам, суммы по персонажам этих пользователей)"""
+        raise NotImplementedError
+
+    def clear_range(self, chat_id, period='all'):
+        """Удаляет посты и дневные суммы чата за период, возвращает число постов"""
+        raise NotImplementedError
+
+    def iter_posts(self, chat_id, batch_size=1000):
+        """Посты чата словарями в порядке id, без загрузки всех в память"""
+        raise NotImplementedError
+
+    def rebuild_rollups(self, chat_id=None):
+        """Пересчитывает post_rollups_daily из posts (для чата или целиком)"""
+        raise NotImplementedError
+
+    def restore_begin(self, chat_id, backup_id, total_rows):
+        """Начинает или продолжает восстановление: (rows_done, deleted_count)"""
+        raise NotImplementedError
+
+    def restore_chunk(self, chat_id, rows, rows_done):
+        """Вставляет пачку и двигает контрольную точку в одной транзакции"""
+        raise NotImplementedError
+
+    def restore_finish(self, chat_id):
+        """Пересчитывает дневные суммы и снимает контрольную точку"""
+        raise NotImplementedError
+
+    def totals(self):
+        """Общие счётчики: total_posts, unique_users, unique_characters"""
+        raise NotImplementedError
+
+
+def _utc_text(value):
+    """datetime (aware - в UTC) или ISO-строка -> 'YYYY-MM-DD HH:MM:SS' в UTC"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _sql(query):
+    """Плейсхолдеры pymysql (%s) -> sqlite3 (?)"""
+    return query.replace('%s', '?')
+
+
+def _param(value):
+    if isinstance(value, datetime):
+        return _utc_text(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def _sqlite_query(query, params):
+    """SQL и параметры общих построителей (aggregated_stats_query и т.п.) для sqlite3"""
+    return _sql(query), [_param(v) for v in params]
+
+
+def _local_day(chat_id, message_date):
+    return periods.local_day(chat_id, message_date).isoformat()
+
+
+def _execute_script(conn, script):
+    """Как executescript, но внутри уже открытой транзакции
+    (executescript сам делает COMMIT перед выполнением)"""
+    for statement in script.split(';'):
+        if statement.strip():
+            conn.execute(statement)
+
+
+def _migration_initial(conn):
+    _execute_script(conn, '''
+        CREATE TABLE IF NOT EXISTS posts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER,
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            character_name TEXT NOT NULL,
+            message_date TEXT NOT NULL,
+            char_count INTEGER DEFAULT 0,
+            points INTEGER DEFAULT 1,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS uniq_chat_message ON posts (chat_id, message_id);
+        CREATE INDEX IF NOT EXISTS idx_chat_date ON posts (chat_id, message_date);
+
+        CREATE TABLE IF NOT EXISTS post_rollups_daily (
+            chat_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            character_name TEXT NOT NULL,
+            username TEXT,
+            posts INTEGER NOT NULL DEFAULT 0,
+            chars INTEGER NOT NULL DEFAULT 0,
+            points INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (chat_id, day, user_id, character_name)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_rollup_chat_user ON post_rollups_daily (chat_id, user_id, day);
+
+        CREATE TABLE IF NOT EXISTS restore_checkpoints (
+            chat_id INTEGER PRIMARY KEY,
+            backup_id TEXT NOT NULL,
+            rows_done INTEGER NOT NULL DEFAULT 0,
+            total_rows INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        );
+    ''')
+
+# Версия = позиция в списке (PRAGMA user_version). Только добавлять в конец.
+SQLITE_MIGRATIONS = [
+    (1, 'initial schema', _migration_initial),
+]
+
+SQLITE_INSERT_POST_SQL = '''
+    INSERT INTO posts
+    (chat_id, user_id, username, character_name, message_date, char_count, points, message_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (chat_id, message_id) DO NOTHING
+'''
+
+SQLITE_INSERT_RESTORED_POST_SQL = '''
+    INSERT INTO posts
+    (chat_id, user_id, username, character_name, message_date, char_count, points, created_at,
+     message_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?)
+    ON CONFLICT (chat_id, message_id) DO NOTHING
+'''
+
+SQLITE_UPSERT_ROLLUP_SQL = '''
+    INSERT INTO post_rollups_daily
+    (chat_id, day, user_id, character_name, username, posts, chars, points)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (chat_id, day, user_id, character_name) DO UPDATE SET
+        username = excluded.username,
+        posts = posts + excluded.posts,
+        chars = chars + excluded.chars,
+        points = points + excluded.points
+'''
+
+
+class SQLiteStorage(Storage):
+    """Встроенное хранилище на SQLite в режиме WAL.
+
+    У каждого потока db_executor своё соединение: читатели не ждут друг
+    друга и писателя. Записи идут через BEGIN IMMEDIATE - SQLite пускает
+    одного писателя, остальные ждут до busy_timeout. ':memory:' - одно
+    общее соединение под замком (для тестов).
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path='posts.db', busy_timeout=30, restore_delete_batch=5000):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.restore_delete_batch = restore_delete_batch
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._connections = []
+        self._shared = None
+        if path == ':memory:':
+            self._shared = self._open()
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout,
+            isolation_level=None,  # транзакции открываем сами
+            check_same_thread=self.path != ':memory:'
+        )
+        conn.row_factory = sqlite3.Row
+        if self.path != ':memory:':
+            conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.create_function('local_day', 2, _local_day, deterministic=True)
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        if self._shared is not None:
+            with self._lock:
+                yield self._shared
+            return
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._open()
+        yield conn
+
+    @contextmanager
+    def _transaction(self):
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def migrate(self):
+        with self._transaction() as conn:
+            current = conn.execute("PRAGMA user_version").fetchone()[0]
+            for version, description, migrate in SQLITE_MIGRATIONS:
+                if version <= current:
+                    continue
+                logger.info(f"🛠️ Миграция SQLite {version}: {description}")
+                migrate(conn)
+                current = version
+            conn.execute(f"PRAGMA user_version = {int(current)}")
+        return current
+
+    def ping(self):
+        with self._connection() as conn:
+            return conn.execute("SELECT 1").fetchone()[0] == 1
+
+    def stats(self):
+        with self._lock:
+            connections = len(self._connections)
+        return {
+            'backend': self.name,
+            'path': self.path,
+            'connections': connections
+        }
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+        self._shared = None
+
+    def save_posts(self, posts):
+        if not posts:
+            return 0
+        new_posts = []
+        with self._transaction() as conn:
+            # Писатель один, поэтому построчная проверка rowcount надёжна
+            for post in unique_in_batch(posts):
+                row = post[:4] + (_utc_text(post[4]),) + post[5:]
+                if conn.execute(SQLITE_INSERT_POST_SQL, row).rowcount:
+                    new_posts.append(post)
+            if new_posts:
+                conn.executemany(
+                    SQLITE_UPSERT_ROLLUP_SQL,
+                    [tuple(_param(v) for v in row) for row in rollup_rows(new_posts)]
+                )
+        return len(new_posts)
+
+    def aggregate(self, chat_id, period='all', user_id=None):
+        query, params = _sqlite_query(*aggregated_stats_query(chat_id, period, user_id))
+        with self._connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+        return merge_latest_username(dict(row) for row in rows)
+
+    def top_users(self, chat_id, period='all', limit=10):
+        query, params = _sqlite_query(*top_users_query(chat_id, period, limit))
+        with self._connection() as conn:
+            top_rows = [dict(row) for row in conn.execute(query, params).fetchall()]
+            if not top_rows:
+                return [], []
+
+            user_ids = [row['user_id'] for row in top_rows]
+            query, params = _sqlite_query(*best_characters_query(chat_id, period, user_ids))
+            character_rows = merge_latest_username(
+                dict(row) for row in conn.execute(query, params).fetchall()
+            )
+        return with_usernames(top_rows, character_rows), character_rows
+
+    def clear_range(self, chat_id, period='all'):
+        rng = periods.resolve(period, chat_id)
+        posts_predicate, posts_params = periods.range_predicate(rng)
+        rollup_predicate, rollup_params = periods.day_predicate(rng)
+        posts_params = [chat_id] + [_param(v) for v in posts_params]
+        rollup_params = [chat_id] + [_param(v) for v in rollup_params]
+
+        with self._transaction() as conn:
+            deleted = conn.execute(
+                "DELETE FROM posts WHERE chat_id = ?" + _sql(posts_predicate), posts_params
+            ).rowcount
+            if deleted:
+                conn.execute(
+                    "DELETE FROM post_rollups_daily WHERE chat_id = ?" + _sql(rollup_predicate),
+                    rollup_params
+                )
+        return deleted
+
+    def iter_posts(self, chat_id, batch_size=1000):
+        with self._connection() as conn:
+            cursor = conn.execute("SELECT * FROM posts WHERE chat_id = ? ORDER BY id", (chat_id,))
+            try:
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield dict(row)
+            finally:
+                cursor.close()
+
+    def _rebuild_rollups(self, conn, chat_id=None):
+        where = ""
+        params = []
+        if chat_id is not None:
+            where = "WHERE chat_id = ?"
+            params.append(chat_id)
+        conn.execute(f"DELETE FROM post_rollups_daily {where}", params)
+        # username - из последнего (наибольший id) поста дня, как в rollup_rows
+        return conn.execute(f'''
+            INSERT INTO post_rollups_daily
+            (chat_id, day, user_id, character_name, username, posts, chars, points)
+            SELECT days.chat_id, days.day, days.user_id, days.character_name, latest.username,
+                   days.posts, days.chars, days.points
+            FROM (
+                SELECT chat_id, local_day(chat_id, message_date) AS day, user_id, character_name,
+                       MAX(id) AS last_id, COUNT(*) AS posts,
+                       COALESCE(SUM(char_count), 0) AS chars, COALESCE(SUM(points), 0) AS points
+                FROM posts
+                {where}
+                GROUP BY chat_id, day, user_id, character_name
+            ) AS days
+            JOIN posts AS latest ON latest.id = days.last_id
+        ''', params).rowcount
+
+    def rebuild_rollups(self, chat_id=None):
+        with self._transaction() as conn:
+            return self._rebuild_rollups(conn, chat_id)
+
+    def restore_begin(self, chat_id, backup_id, total_rows):
+        with self._connection() as conn:
+            checkpoint = conn.execute(
+                "SELECT backup_id, rows_done FROM restore_checkpoints WHERE chat_id = ?",
+                (chat_id,)
+            ).fetchone()
+        if checkpoint and checkpoint['backup_id'] == backup_id:
+            return checkpoint['rows_done'], 0
+
+        deleted_count = 0
+        while True:
+            # Пачками, чтобы не держать блокировку записи слишком долго
+            with self._transaction() as conn:
+                deleted = conn.execute('''
+                    DELETE FROM posts WHERE id IN (
+                        SELECT id FROM posts WHERE chat_id = ? LIMIT ?
+                    )
+                ''', (chat_id, self.restore_delete_batch)).rowcount
+            deleted_count += deleted
+            if deleted < self.restore_delete_batch:
+                break
+
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM post_rollups_daily WHERE chat_id = ?", (chat_id,))
+            conn.execute('''
+                INSERT INTO restore_checkpoints (chat_id, backup_id, rows_done, total_rows)
+                VALUES (?, ?, 0, ?)
+                ON CONFLICT (chat_id) DO UPDATE SET backup_id = excluded.backup_id,
+                    rows_done = 0, total_rows = excluded.total_rows,
+                    updated_at = CURRENT_TIMESTAMP
+            ''', (chat_id, backup_id, total_rows))
+        return 0, deleted_count
+
+    def restore_chunk(self, chat_id, rows, rows_done):
+        with self._transaction() as conn:
+            if rows:
+                conn.executemany(SQLITE_INSERT_RESTORED_POST_SQL, [
+                    row[:4] + (_utc_text(row[4]),) + row[5:7] + (_utc_text(row[7]),) + row[8:]
+                    for row in rows
+                ])
+            conn.execute(
+                "UPDATE restore_checkpoints SET rows_done = ?, updated_at = CURRENT_TIMESTAMP "
+                "WHERE chat_id = ?",
+                (rows_done, chat_id)
+            )
+
+    def restore_finish(self, chat_id):
+        with self._transaction() as conn:
+            self._rebuild_rollups(conn, chat_id)
+            conn.execute("DELETE FROM restore_checkpoints WHERE chat_id = ?", (chat_id,))
+
+    def totals(self):
+        with self._connection() as conn:
+            row = conn.execute('''
+                SELECT COUNT(*) AS total_posts,
+                       COUNT(DISTINCT user_id) AS unique_users,
+                       COUNT(DISTINCT character_name) AS unique_characters
+                FROM posts
+            ''').fetchone()
+        return dict(row)
+
+
+class _PoolEntry:
+    """Соединение из пула и его временные метки"""
+    __slots__ = ('conn', 'created_at', 'last_used')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class TiDBConnectionPool:
+    """Ограниченный потокобезопасный пул соединений pymysql.
+
+    Держит от min_size до max_size соединений. При выдаче проверяет
+    соединение пингом (если оно простаивало дольше ping_interval),
+    закрывает простаивающие дольше idle_timeout (сверх min_size)
+    и пересоздаёт соединения старше max_lifetime.
+
+    Соединения работают в autocommit: чтение не открывает транзакцию,
+    а запись, которой нужна атомарность, начинает её сама (conn.begin()).
+    Поэтому при возврате в пул ROLLBACK нужен только если транзакция
+    осталась открытой или блок завершился ошибкой.
+    """
+
+    def __init__(self, db_config, min_size=1, max_size=10, idle_timeout=300,
+                 max_lifetime=1800, ping_interval=5, acquire_timeout=10):
+        self.db_config = db_config
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.ping_interval = ping_interval
+        self.acquire_timeout = acquire_timeout
+
+        self._idle = deque()
+        self._in_use = {}
+        self._size = 0
+        self._waiting = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        self.created_count = 0
+        self.recycled_count = 0
+
+        for _ in range(self.min_size):
+            with self._cond:
+                self._size += 1
+            try:
+                entry = self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+            with self._cond:
+                self._idle.append(entry)
+
+    def _open(self):
+        conn = pymysql.connect(**dict(self.db_config, autocommit=True))
+        self.created_count += 1
+        return _PoolEntry(conn)
+
+    def _discard(self, entry):
+        """Закрывает соединение (слот в пуле освобождает вызывающий)"""
+        self.recycled_count += 1
+        try:
+            entry.conn.close()
+        except Exception:
+            pass
+
+    def _evict_idle(self, now):
+        """Убирает из простаивающих просроченные соединения. Вызывать под self._cond"""
+        expired = []
+        kept = deque()
+        for entry in self._idle:
+            too_old = now - entry.created_at > self.max_lifetime
+            too_idle = (now - entry.last_used > self.idle_timeout
+                        and self._size - len(expired) > self.min_size)
+            if too_old or too_idle:
+                expired.append(entry)
+            else:
+                kept.append(entry)
+        self._idle = kept
+        self._size -= len(expired)
+        return expired
+
+    def acquire(self):
+        """Берёт соединение из пула (или открывает новое, если есть место)"""
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            entry = None
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError("Пул соединений закрыт")
+                expired = self._evict_idle(time.monotonic())
+                if expired:
+                    self._cond.notify_all()
+
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(
+                            f"Нет свободных соединений в пуле ({self.max_size})"
+                        )
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+                if self._idle:
+                    # LIFO: самое «тёплое» соединение реже требует пинга
+                    entry = self._idle.pop()
+                else:
+                    self._size += 1
+
+            for old in expired:
+                self._discard(old)
+
+            if entry is None:
+                try:
+                    entry = self._open()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif time.monotonic() - entry.last_used > self.ping_interval:
+                try:
+                    entry.conn.ping(reconnect=False)
+                except Exception:
+                    self._discard(entry)
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    continue
+
+            with self._cond:
+                self._in_use[id(entry.conn)] = entry
+            return entry.conn
+
+    def release(self, conn, discard=False, failed=False):
+        """Возвращает соединение в пул (failed - блок с ним завершился ошибкой)"""
+        with self._cond:
+            entry = self._in_use.pop(id(conn), None)
+        if entry is None:
+            return
+
+        now = time.monotonic()
+        in_transaction = (conn.server_status or 0) & SERVER_STATUS.SERVER_STATUS_IN_TRANS
+        if not discard and (failed or in_transaction):
+            try:
+                # Не оставляем открытую транзакцию следующему владельцу
+                conn.rollback()
+            except Exception:
+                discard = True
+
+        if discard or self._closed or now - entry.created_at > self.max_lifetime:
+            self._discard(entry)
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            return
+
+        entry.last_used = now
+        with self._cond:
+            self._idle.append(entry)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """with db_pool.connection() as conn: ..."""
+        conn = self.acquire()
+        try:
+            yield conn
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            self.release(conn, discard=True)
+            raise
+        except BaseException:
+            self.release(conn, failed=True)
+            raise
+        else:
+            self.release(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': len(self._in_use),
+                'waiting': self._waiting,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'created': self.created_count,
+                'recycled': self.recycled_count
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for entry in idle:
+            self._discard(entry)
+
+
+def _column_info(cursor, table):
+    """Колонки таблицы: имя -> (тип, nullable, default)"""
+    cursor.execute('''
+        SELECT COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, COLUMN_DEFAULT
+        FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    ''', (table,))
+    return {
+        row[0].lower(): (row[1].lower(), row[2] == 'YES', row[3])
+        for row in cursor.fetchall()
+    }
+
+
+def _index_exists(cursor, table, index_name):
+    cursor.execute('''
+        SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+        LIMIT 1
+    ''', (table, index_name))
+    return cursor.fetchone() is not None
+
+
+def _add_index(cursor, table, index_name, columns):
+    if not _index_exists(cursor, table, index_name):
+        cursor.execute(f"ALTER TABLE {table} ADD INDEX {index_name} ({columns})")
+
+
+def _migration_create_posts(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS posts (
+            id BIGINT PRIMARY KEY AUTO_INCREMENT,
+            chat_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            username VARCHAR(255),
+            character_name VARCHAR(255) NOT NULL,
+            message_date DATETIME NOT NULL,
+            char_count INT DEFAULT 0,
+            points INT DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    ''')
+
+
+def _migration_reconcile_posts(cursor):
+    """Приводит posts, созданную старым save_to_tidb (INT id, без NOT NULL),
+    к схеме из init_tidb. Индексы задаёт миграция 6"""
+    columns = _column_info(cursor, 'posts')
+
+    id_type = columns.get('id', ('bigint',))[0]
+    if not id_type.startswith('bigint'):
+        try:
+            cursor.execute("ALTER TABLE posts MODIFY COLUMN id BIGINT NOT NULL AUTO_INCREMENT")
+        except pymysql.err.MySQLError as e:
+            # TiDB не всегда умеет менять тип кластерного ключа - не критично
+            logger.warning(f"⚠️ Не удалось расширить posts.id до BIGINT: {e}")
+
+    not_null = {
+        'chat_id': 'BIGINT',
+        'user_id': 'BIGINT',
+        'character_name': 'VARCHAR(255)',
+        'message_date': 'DATETIME'
+    }
+    for column, column_type in not_null.items():
+        if not columns.get(column, ('', False))[1]:
+            continue
+        cursor.execute(f"SELECT COUNT(*) FROM posts WHERE {column} IS NULL")
+        if cursor.fetchone()[0]:
+            logger.warning(f"⚠️ В posts.{column} есть NULL, NOT NULL не добавлен")
+            continue
+        cursor.execute(f"ALTER TABLE posts MODIFY COLUMN {column} {column_type} NOT NULL")
+
+    if columns.get('char_count', ('', True, None))[2] is None:
+        cursor.execute("ALTER TABLE posts ALTER COLUMN char_count SET DEFAULT 0")
+    if columns.get('points', ('', True, None))[2] is None:
+        cursor.execute("ALTER TABLE posts ALTER COLUMN points SET DEFAULT 1")
+
+
+def _migration_create_rollups(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS post_rollups_daily (
+            chat_id BIGINT NOT NULL,
+            day DATE NOT NULL,
+            user_id BIGINT NOT NULL,
+            character_name VARCHAR(255) NOT NULL,
+            username VARCHAR(255),
+            posts INT NOT NULL DEFAULT 0,
+            chars BIGINT NOT NULL DEFAULT 0,
+            points INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (chat_id, day, user_id, character_name),
+            INDEX idx_rollup_chat_user (chat_id, user_id, day)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    ''')
+    _rebuild_rollups(cursor)
+
+
+def _migration_create_restore_checkpoints(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS restore_checkpoints (
+            chat_id BIGINT PRIMARY KEY,
+            backup_id VARCHAR(64) NOT NULL,
+            rows_done INT NOT NULL DEFAULT 0,
+            total_rows INT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _migration_add_message_id(cursor):
+    """message_id и уникальный ключ по (chat_id, message_id) - повторная
+    доставка того же сообщения больше не создаёт второй пост.
+    У старых постов message_id = NULL, уникальность на них не действует."""
+    if 'message_id' not in _column_info(cursor, 'posts'):
+        cursor.execute("ALTER TABLE posts ADD COLUMN message_id BIGINT NULL AFTER chat_id")
+    if not _index_exists(cursor, 'posts', 'uniq_chat_message'):
+        cursor.execute("ALTER TABLE posts ADD UNIQUE INDEX uniq_chat_message (chat_id, message_id)")
+
+
+def _migration_covering_indexes(cursor):
+    """Индексы под реальные запросы к posts (план проверяет query_plans.py):
+    диапазоны периода и /clearstats по чату, бэкап чата в порядке id.
+
+    Индексы старой схемы (по пользователю, персонажу и дате) не нужны ни
+    одному запросу - статистика читает post_rollups_daily, - а каждый
+    лишний индекс стоит записи на каждый пост"""
+    _add_index(cursor, 'posts', 'idx_chat_date', 'chat_id, message_date')
+    _add_index(cursor, 'posts', 'idx_chat_id', 'chat_id, id')
+    for index_name in ('idx_chat_user', 'idx_character', 'idx_date'):
+        if _index_exists(cursor, 'posts', index_name):
+            cursor.execute(f"ALTER TABLE posts DROP INDEX {index_name}")
+
+
+def _migration_rebuild_local_days(cursor):
+    """Дни в post_rollups_daily раньше были днями UTC - пересчёт по местным
+    дням чатов (periods.py)"""
+    _rebuild_rollups(cursor)
+
+
+# Порядок важен: версия = позиция в списке. Только добавлять в конец.
+MIGRATIONS = [
+    (1, 'create posts', _migration_create_posts),
+    (2, 'reconcile posts schema', _migration_reconcile_posts),
+    (3, 'create and backfill post_rollups_daily', _migration_create_rollups),
+    (4, 'create restore_checkpoints', _migration_create_restore_checkpoints),
+    (5, 'add posts.message_id with unique (chat_id, message_id)', _migration_add_message_id),
+    (6, 'indexes for clearstats and backup queries', _migration_covering_indexes),
+    (7, 'rebuild post_rollups_daily on chat-local days', _migration_rebuild_local_days),
+]
+
+
+def run_migrations(pool):
+    """Применяет недостающие миграции и возвращает текущую версию схемы"""
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+
+        # Несколько воркеров могут стартовать одновременно
+        locked = False
+        try:
+            cursor.execute("SELECT GET_LOCK('posts_schema_migration', 60)")
+            locked = cursor.fetchone()[0] == 1
+        except pymysql.err.MySQLError:
+            pass
+
+        try:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INT PRIMARY KEY,
+                    description VARCHAR(255),
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+            current = cursor.fetchone()[0]
+
+            for version, description, migrate in MIGRATIONS:
+                if version <= current:
+                    continue
+                logger.info(f"🛠️ Миграция схемы {version}: {description}")
+                conn.begin()
+                migrate(cursor)
+                cursor.execute(
+                    "INSERT IGNORE INTO schema_version (version, description) VALUES (%s, %s)",
+                    (version, description)
+                )
+                conn.commit()
+                current = version
+        finally:
+            if locked:
+                cursor.execute("SELECT RELEASE_LOCK('posts_schema_migration')")
+                cursor.fetchone()
+
+        return current
+
+
+# Повтор того же (chat_id, message_id) ничего не меняет
+INSERT_POST_SQL = '''
+    INSERT INTO posts
+    (chat_id, user_id, username, character_name, message_date, char_count, points, message_id)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE id = id
+'''
+
+
+UPSERT_ROLLUP_SQL = '''
+    INSERT INTO post_rollups_daily
+    (chat_id, day, user_id, character_name, username, posts, chars, points)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        username = VALUES(username),
+        posts = posts + VALUES(posts),
+        chars = chars + VALUES(chars),
+        points = points + VALUES(points)
+'''
+
+
+def _rebuild_rollups(cursor, chat_id=None):
+    """Пересчитывает post_rollups_daily из posts (для чата или целиком)"""
+    where = ""
+    params = []
+    if chat_id is not None:
+        where = "WHERE chat_id = %s"
+        params.append(chat_id)
+
+    cursor.execute(f"DELETE FROM post_rollups_daily {where}", params)
+    # День - местный день чата, как и в rollup_rows
+    day_expr, day_params = periods.local_day_sql()
+    # username - из последнего (наибольший id) поста дня, как в rollup_rows
+    cursor.execute(f'''
+        INSERT INTO post_rollups_daily
+        (chat_id, day, user_id, character_name, username, posts, chars, points)
+        SELECT days.chat_id, days.day, days.user_id, days.character_name, latest.username,
+               days.posts, days.chars, days.points
+        FROM (
+            SELECT chat_id, day, user_id, character_name, MAX(id) AS last_id,
+                   COUNT(*) AS posts, COALESCE(SUM(char_count), 0) AS chars,
+                   COALESCE(SUM(points), 0) AS points
+            FROM (
+                SELECT id, chat_id, {day_expr} AS day, user_id, character_name,
+                       char_count, points
+                FROM posts
+                {where}
+            ) AS local_posts
+            GROUP BY chat_id, day, user_id, character_name
+        ) AS days
+        JOIN posts AS latest ON latest.id = days.last_id
+    ''', day_params + params)
+    return cursor.rowcount
+
+
+def _existing_message_ids(cursor, posts):
+    """(chat_id, message_id) из пачки, которые уже есть в posts.
+
+    FOR UPDATE блокирует эти ключи до коммита, так что параллельная
+    пачка с теми же сообщениями дождётся нас и увидит их как дубли.
+    """
+    by_chat = {}
+    for post in posts:
+        if post[7] is not None:
+            by_chat.setdefault(post[0], []).append(post[7])
+
+    existing = set()
+    for chat_id, message_ids in by_chat.items():
+        placeholders = ', '.join(['%s'] * len(message_ids))
+        cursor.execute(f'''
+            SELECT message_id FROM posts
+            WHERE chat_id = %s AND message_id IN ({placeholders})
+            FOR UPDATE
+        ''', [chat_id] + message_ids)
+        existing.update((chat_id, row[0]) for row in cursor.fetchall())
+    return existing
+
+
+def rollup_period_where(chat_id, period='all', user_id=None):
+    """WHERE по post_rollups_daily для чата, периода и (если задан) пользователя"""
+    where = "WHERE chat_id = %s"
+    params = [chat_id]
+
+    if user_id:
+        where += " AND user_id = %s"
+        params.append(user_id)
+
+    predicate, day_params = periods.day_predicate(periods.resolve(period, chat_id))
+    return where + predicate, params + day_params
+
+
+def aggregated_stats_query(chat_id, period='all', user_id=None):
+    """SQL и параметры для aggregate (TiDB и SQLite)"""
+    where, params = rollup_period_where(chat_id, period, user_id)
+    query = f'''
+        SELECT user_id, username, character_name, MAX(day) AS last_day,
+               SUM(posts) AS posts, SUM(chars) AS chars, SUM(points) AS points
+        FROM post_rollups_daily
+        {where}
+        GROUP BY user_id, character_name, username
+    '''
+    return query, params
+
+
+def top_users_query(chat_id, period='all', limit=10):
+    """SQL и параметры первого запроса top_users (TiDB и SQLite)"""
+    where, params = rollup_period_where(chat_id, period)
+    query = f'''
+        SELECT user_id,
+               SUM(posts) AS posts, SUM(chars) AS chars, SUM(points) AS points,
+               COUNT(DISTINCT character_name) AS characters
+        FROM post_rollups_daily
+        {where}
+        GROUP BY user_id
+        ORDER BY points DESC, user_id
+        LIMIT %s
+    '''
+    return query, params + [limit]
+
+
+def best_characters_query(chat_id, period, user_ids):
+    """SQL и параметры второго запроса top_users (TiDB и SQLite)"""
+    where, params = rollup_period_where(chat_id, period)
+    placeholders = ', '.join(['%s'] * len(user_ids))
+    query = f'''
+        SELECT user_id, character_name, username, MAX(day) AS last_day,
+               SUM(posts) AS posts, SUM(chars) AS chars, SUM(points) AS points
+        FROM post_rollups_daily
+        {where} AND user_id IN ({placeholders})
+        GROUP BY user_id, character_name, username
+    '''
+    return query, params + list(user_ids)
+
+
+def clear_posts_where(chat_id, period='all'):
+    """WHERE для posts и post_rollups_daily в /clearstats и параметры к ним.
+
+    Границы - целые местные дни чата, так что посты и дневные суммы
+    удаляются за один и тот же интервал.
+    """
+    # Для 'all', 'да', 'yes', 'confirm' - без границ, удаляем все
+    rng = periods.resolve(period, chat_id)
+    posts_predicate, posts_params = periods.range_predicate(rng)
+    rollup_predicate, rollup_params = periods.day_predicate(rng)
+    return (
+        "WHERE chat_id = %s" + posts_predicate, [chat_id] + posts_params,
+        "WHERE chat_id = %s" + rollup_predicate, [chat_id] + rollup_params
+    )
+
+
+BACKUP_POSTS_SQL = '''
+    SELECT * FROM posts
+    WHERE chat_id = %s
+    ORDER BY id ASC
+'''
+
+
+INSERT_RESTORED_POST_SQL = '''
+    INSERT INTO posts
+    (chat_id, user_id, username, character_name, message_date, char_count, points, created_at,
+     message_id)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE id = id
+'''
+
+
+class TiDBStorage(Storage):
+    """Хранилище в TiDB Cloud / MySQL поверх TiDBConnectionPool.
+
+    SQL строят функции выше (их же проверяет query_plans.py).
+    """
+
+    name = 'tidb'
+
+    def __init__(self, pool, restore_delete_batch=5000):
+        self.pool = pool
+        self.restore_delete_batch = restore_delete_batch
+
+    def migrate(self):
+        return run_migrations(self.pool)
+
+    def ping(self):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+            cursor.close()
+        return True
+
+    def stats(self):
+        return self.pool.stats()
+
+    def close(self):
+        self.pool.close()
+
+    def save_posts(self, posts):
+        posts = unique_in_batch(posts)
+        with self.pool.connection() as conn:
+            conn.begin()
+            cursor = conn.cursor()
+            existing = _existing_message_ids(cursor, posts)
+            new_posts = [post for post in posts if (post[0], post[7]) not in existing]
+            if new_posts:
+                # pymysql сам склеивает executemany для INSERT ... VALUES в multi-row INSERT
+                cursor.executemany(INSERT_POST_SQL, new_posts)
+                cursor.executemany(UPSERT_ROLLUP_SQL, rollup_rows(new_posts))
+            conn.commit()
+        return len(new_posts)
+
+    def aggregate(self, chat_id, period='all', user_id=None):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor(DictCursor)
+            cursor.execute(*aggregated_stats_query(chat_id, period, user_id))
+            return merge_latest_username(cursor.fetchall())
+
+    def top_users(self, chat_id, period='all', limit=10):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor(DictCursor)
+            cursor.execute(*top_users_query(chat_id, period, limit))
+            top_rows = cursor.fetchall()
+            if not top_rows:
+                return [], []
+
+            user_ids = [row['user_id'] for row in top_rows]
+            cursor.execute(*best_characters_query(chat_id, period, user_ids))
+            character_rows = merge_latest_username(cursor.fetchall())
+            return with_usernames(top_rows, character_rows), character_rows
+
+    def clear_range(self, chat_id, period='all'):
+        where_clause, params, rollup_where, rollup_params = clear_posts_where(chat_id, period)
+
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+
+            # Сначала считаем сколько будет удалено
+            cursor.execute(f"SELECT COUNT(*) FROM posts {where_clause}", params)
+            count_to_delete = cursor.fetchone()[0]
+            if count_to_delete == 0:
+                return 0
+
+            # Удаляем посты и их дневные суммы
+            conn.begin()
+            cursor.execute(f"DELETE FROM posts {where_clause}", params)
+            cursor.execute(f"DELETE FROM post_rollups_daily {rollup_where}", rollup_params)
+            conn.commit()
+        return count_to_delete
+
+    def iter_posts(self, chat_id, batch_size=1000):
+        # Небуферизованный курсор: строки приходят с сервера по мере чтения
+        with self.pool.connection() as conn:
+            cursor = conn.cursor(SSDictCursor)
+            try:
+                cursor.execute(BACKUP_POSTS_SQL, (chat_id,))
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield from rows
+            finally:
+                cursor.close()
+
+    def rebuild_rollups(self, chat_id=None):
+        with self.pool.connection() as conn:
+            conn.begin()
+            cursor = conn.cursor()
+            rows = _rebuild_rollups(cursor, chat_id)
+            conn.commit()
+        return rows
+
+    def restore_begin(self, chat_id, backup_id, total_rows):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT backup_id, rows_done FROM restore_checkpoints WHERE chat_id = %s",
+                (chat_id,)
+            )
+            checkpoint = cursor.fetchone()
+            if checkpoint and checkpoint[0] == backup_id:
+                return checkpoint[1], 0
+
+            # Каждая пачка удаления - отдельная (autocommit) транзакция
+            deleted_count = 0
+            while True:
+                cursor.execute(
+                    "DELETE FROM posts WHERE chat_id = %s LIMIT %s",
+                    (chat_id, self.restore_delete_batch)
+                )
+                deleted_count += cursor.rowcount
+                if cursor.rowcount < self.restore_delete_batch:
+                    break
+
+            conn.begin()
+            cursor.execute("DELETE FROM post_rollups_daily WHERE chat_id = %s", (chat_id,))
+            cursor.execute('''
+                INSERT INTO restore_checkpoints (chat_id, backup_id, rows_done, total_rows)
+                VALUES (%s, %s, 0, %s)
+                ON DUPLICATE KEY UPDATE backup_id = VALUES(backup_id), rows_done = 0,
+                                        total_rows = VALUES(total_rows)
+            ''', (chat_id, backup_id, total_rows))
+            conn.commit()
+        return 0, deleted_count
+
+    def restore_chunk(self, chat_id, rows, rows_done):
+        with self.pool.connection() as conn:
+            conn.begin()
+            cursor = conn.cursor()
+            if rows:
+                cursor.executemany(INSERT_RESTORED_POST_SQL, rows)
+            cursor.execute(
+                "UPDATE restore_checkpoints SET rows_done = %s WHERE chat_id = %s",
+                (rows_done, chat_id)
+            )
+            conn.commit()
+
+    def restore_finish(self, chat_id):
+        with self.pool.connection() as conn:
+            conn.begin()
+            cursor = conn.cursor()
+            _rebuild_rollups(cursor, chat_id)
+            cursor.execute("DELETE FROM restore_checkpoints WHERE chat_id = %s", (chat_id,))
+            conn.commit()
+
+    def totals(self):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor(DictCursor)
+            cursor.execute('''
+                SELECT COUNT(*) AS total_posts,
+                       COUNT(DISTINCT user_id) AS unique_users,
+                       COUNT(DISTINCT character_name) AS unique_characters
+                FROM posts
+            ''')
+            row = cursor.fetchone()
+            cursor.close()
+        return row
+
+    def server_info(self):
+        """(версия сервера, имя базы)"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT VERSION(), DATABASE()')
+            return cursor.fetchone()
+
+    def explain(self, query, params):
+        """EXPLAIN запроса строками-словарями (для query_plans.py).
+        EXPLAIN DELETE ничего не удаляет, а в autocommit и транзакции не оставляет"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor(DictCursor)
+            cursor.execute(f"EXPLAIN {query}", params)
+            return cursor.fetchall()
+
+    def analyze(self, tables=('posts', 'post_rollups_daily')):
+        """Обновляет статистику оптимизатора по таблицам"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            for table in tables:
+                cursor.execute(f"ANALYZE TABLE {table}")
+                cursor.fetchall()
+
+    def last_post_ids(self):
+        """(chat_id, user_id) последнего сохранённого поста или None"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT chat_id, user_id FROM posts ORDER BY id DESC LIMIT 1")
+            row = cursor.fetchone()
+        return (row[0], row[1]) if row else None
@@ -0,0 +1,75 @@
+"""Регрессия планов запросов: EXPLAIN каждого запроса бота без полного просмотра.
+
+Нужна отдельная тестовая база TiDB/MySQL (TEST_DATABASE_URL), без неё тест
+пропускается:
+    TEST_DATABASE_URL=mysql://... python -m pytest test_query_plans.py
+DATABASE_URL тест не читает - он задан и в проде, а тест пишет в базу посты
+(в отдельные отрицательные чаты, и удаляет их после себя).
+"""
+import io
+import os
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+TEST_DATABASE_URL = os.getenv('TEST_DATABASE_URL')
+
+pytestmark = pytest.mark.skipif(
+    not TEST_DATABASE_URL, reason="TEST_DATABASE_URL не задан"
+)
+
+CHATS = 20
+USERS = 5
+POSTS_PER_CHAT = 200
+
+
+@pytest.fixture(scope='module')
+def seeded():
+    """Посты в CHATS чатах - чтобы чат был малой долей таблицы даже на пустой базе"""
+    # app читает DATABASE_URL при импорте - подменяем до него
+    os.environ['DATABASE_URL'] = TEST_DATABASE_URL
+    import app as bot
+    bot.DATABASE_URL = TEST_DATABASE_URL
+
+    storage = bot.require_storage()
+    base_chat = -(10 ** 12) - random.randrange(10 ** 6) * CHATS
+    chat_ids = [base_chat - i for i in range(CHATS)]
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+
+    posts = []
+    for chat_id in chat_ids:
+        for n in range(POSTS_PER_CHAT):
+            user_id = 1000 + n % USERS
+            posts.append((
+                chat_id, user_id, f"user{user_id}", f"Персонаж {n % 7}",
+                now - timedelta(hours=n * 7), 100 + n, 1 + n % 3, n + 1
+            ))
+    storage.save_posts(posts)
+    storage.analyze()
+
+    yield bot, chat_ids[0], 1000
+
+    for chat_id in chat_ids:
+        storage.clear_range(chat_id, 'all')
+
+
+def test_no_full_table_scans(seeded):
+    import query_plans
+
+    bot, chat_id, user_id = seeded
+    out = io.StringIO()
+    failures = query_plans.check_query_plans(chat_id, user_id, out=out)
+    assert failures == [], out.getvalue()
+
+
+def test_plan_cases_cover_bot_queries(seeded):
+    import query_plans
+
+    bot, chat_id, user_id = seeded
+    names = [name for name, _, _ in query_plans.plan_cases(chat_id, user_id)]
+    for period in query_plans.PERIODS:
+        assert f'aggregated stats {period}' in names
+        assert f'top users {period}' in names
+        assert f'clear_posts delete {period}' in names
+    assert 'write_backup_stream' in names